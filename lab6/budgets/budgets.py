@@ -7,6 +7,7 @@ from pydantic import BaseModel
 from datetime import date, datetime
 from jose import JWTError, jwt
 from typing import List
+from token_cache import TokenCache
 import os
 import asyncio
 
@@ -14,9 +15,11 @@ import asyncio
 SECRET_KEY = "your-secret-key"
 ALGORITHM = "HS256"
 ADMIN = 'admin'
+TOKEN_CACHE_SIZE = int(os.getenv('TOKEN_CACHE_SIZE', '10000'))
 
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl='http://127.0.0.1:8000/token')
+token_cache = TokenCache(TOKEN_CACHE_SIZE)
 
 
 app = FastAPI()
@@ -69,17 +72,25 @@ async def get_current_client(token: str = Depends(oauth2_scheme)):
         detail='Не получается валидировать поля',
         headers={'WWW-Authenticate': 'Bearer'},
     )
+    if (login := token_cache.get(token)) is not None:
+        return login
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         login: str = payload.get('login')
         if login is None:
             raise credentials_exception
         else:
+            token_cache.put(token, login, payload.get('exp'))
             return login
     except JWTError:
         raise credentials_exception
 
 
+@app.get("/metrics", tags=["Служебные ручки"])
+async def get_metrics():
+    return {'token_cache': token_cache.stats()}
+
+
 @app.get("/all_incomes/", tags=["Основные ручки"], response_model=List[Budget])
 async def get_all_incomes(current_user_login: str = Depends(get_current_client)):
     if current_user_login == ADMIN:
@@ -0,0 +1,46 @@
+from collections import OrderedDict
+from typing import Optional
+import time
+
+
+class TokenCache:
+    def __init__(self, max_size: int = 10000):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, token: str) -> Optional[str]:
+        entry = self.entries.get(token)
+        if entry is None:
+            self.misses += 1
+            return None
+        login, expires_at = entry
+        if expires_at <= time.time():
+            del self.entries[token]
+            self.misses += 1
+            return None
+        self.entries.move_to_end(token)
+        self.hits += 1
+        return login
+
+    def put(self, token: str, login: str, expires_at: Optional[float]):
+        if expires_at is None or expires_at <= time.time():
+            return
+        self.entries[token] = (login, expires_at)
+        self.entries.move_to_end(token)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        requests = self.hits + self.misses
+        return {
+            'size': len(self.entries),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_ratio': round(self.hits / requests, 4) if requests else 0.0,
+        }
@@ -0,0 +1,85 @@
+from confluent_kafka import TopicPartition
+from consumer import Base, PartitionWorker, SessionLocal, engine, process_batch, process_message, CONSUMER_BATCH_SIZE
+from events import encode_event, partition_for
+from users import User, PASSWORD, EVENT_FORMAT
+import os
+import time
+
+
+BENCHMARK_USERS = int(os.getenv('BENCHMARK_USERS', '2000'))
+BENCHMARK_WORKERS = [int(count) for count in os.getenv('BENCHMARK_WORKERS', '1,2,4').split(',')]
+
+
+class BenchmarkMessage:
+    def __init__(self, key: str, payload: bytes, offset: int):
+        self.key = key
+        self.payload = payload
+        self.position = offset
+
+    def value(self):
+        return self.payload
+
+    def offset(self):
+        return self.position
+
+
+def make_messages(prefix: str, count: int) -> list:
+    messages = []
+    for i in range(count):
+        user = {
+            'login': f'{prefix}{i}', 'password': PASSWORD, 'name': 'Bench',
+            'surname': f'User{i}', 'age': 30, 'email': None
+        }
+        messages.append((user['login'], encode_event('create', user, EVENT_FORMAT)))
+        update = dict(user, age=31, old_login=user['login'])
+        messages.append((user['login'], encode_event('update', update, EVENT_FORMAT)))
+    for i in range(0, count, 2):
+        messages.append((f'{prefix}{i}', encode_event('delete', {'login': f'{prefix}{i}'}, EVENT_FORMAT)))
+    return [BenchmarkMessage(key, payload, offset) for offset, (key, payload) in enumerate(messages)]
+
+
+def apply_one_by_one(db, messages):
+    for message in messages:
+        process_message(db, message)
+
+
+def apply_in_batches(batch_size: int):
+    def apply(db, messages):
+        for start in range(0, len(messages), batch_size):
+            process_batch(db, messages[start:start + batch_size])
+    return apply
+
+
+def apply_with_workers(count: int):
+    def apply(db, messages):
+        workers = [PartitionWorker(TopicPartition('user_events', i), CONSUMER_BATCH_SIZE) for i in range(count)]
+        for message in messages:
+            workers[partition_for(message.key, count)].submit(message)
+        for worker in workers:
+            worker.stop()
+        for worker in workers:
+            worker.join()
+    return apply
+
+
+def run(label: str, prefix: str, apply):
+    messages = make_messages(prefix, BENCHMARK_USERS)
+    db = SessionLocal()
+    try:
+        started = time.perf_counter()
+        apply(db, messages)
+        elapsed = time.perf_counter() - started
+        db.query(User).filter(User.login.startswith(prefix)).delete(synchronize_session=False)
+        db.commit()
+    finally:
+        db.close()
+    print(f'{label}: {len(messages)} событий за {elapsed:.2f} с ({len(messages) / elapsed:.0f} событий/с)')
+
+
+if __name__ == '__main__':
+    Base.metadata.create_all(bind=engine)
+    run('По одному событию', 'bench_single_', apply_one_by_one)
+    for batch_size in sorted({100, CONSUMER_BATCH_SIZE}):
+        run(f'Пачками по {batch_size}', f'bench_batch_{batch_size}_', apply_in_batches(batch_size))
+    for count in BENCHMARK_WORKERS:
+        run(f'Потоков по партициям: {count}', f'bench_workers_{count}_', apply_with_workers(count))
@@ -0,0 +1,371 @@
+from fastapi import BackgroundTasks
+from fastapi.testclient import TestClient
+from sqlalchemy import and_, select, text
+from sqlalchemy.orm import Session
+from cache import JsonCodec, MsgpackCodec, search_key, user_key
+from events import decode_event, encode_event
+from users import (
+    User, ADMIN, EXPIRE_SECONDS, PASSWORD, REDIS_URL, AsyncSessionLocal, app, create_access_token, engine,
+    get_users_by_name_and_surname, hash, mask_search_query, serialize, stream_users, user_cache
+)
+import asyncio
+import json
+import os
+import random
+import resource
+import statistics
+import sys
+import time
+import zlib
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+
+SEED_CHUNK_SIZE = 10000
+REPEATS = int(os.getenv('BENCHMARK_REPEATS', '5'))
+WARM_USERS = int(os.getenv('BENCHMARK_WARM_USERS', '10000'))
+CACHE_USERS = int(os.getenv('BENCHMARK_CACHE_USERS', '1000000'))
+CONCURRENCY_USERS = int(os.getenv('BENCHMARK_CONCURRENCY_USERS', '10000'))
+CONCURRENCY_REQUESTS = int(os.getenv('BENCHMARK_CONCURRENCY_REQUESTS', '2000'))
+CONCURRENCY = [int(level) for level in os.getenv('BENCHMARK_CONCURRENCY', '1,4,16,64').split(',')]
+STREAM_ROWS = int(os.getenv('BENCHMARK_STREAM_ROWS', '1000000'))
+SEARCH_ROWS = int(os.getenv('BENCHMARK_SEARCH_ROWS', '2000000'))
+SEARCH_MASKS = [('An*', '*'), ('*', 'Iva*'), ('*', '*ov'), ('*na', '*ova'), ('A?n*', 'I*')]
+NAMES = ['Anna', 'Andrey', 'Anton', 'Boris', 'Elena', 'Ivan', 'Maria', 'Nikolay', 'Olga', 'Pavel']
+SURNAMES = ['Ivanov', 'Ivanova', 'Petrov', 'Petrova', 'Sidorov', 'Smirnova', 'Kuznetsov', 'Volkova']
+EVENTS = int(os.getenv('BENCHMARK_EVENTS', '100000'))
+EVENT_BATCH = int(os.getenv('BENCHMARK_EVENT_BATCH', '100'))
+LIST_SIZES = [int(size) for size in os.getenv('BENCHMARK_LIST_SIZES', '100,250,500,1000').split(',')]
+
+scenarios = {}
+
+
+def scenario(name: str):
+    def register(func):
+        scenarios[name] = func
+        return func
+    return register
+
+
+def seed_users(prefix: str, count: int, name=lambda i: 'Bench', surname=lambda i: f'User{i}'):
+    with engine.begin() as connection:
+        for start in range(0, count, SEED_CHUNK_SIZE):
+            connection.execute(User.__table__.insert(), [{
+                'login': f'{prefix}{i:08d}', 'password': PASSWORD, 'name': name(i),
+                'surname': surname(i), 'age': 30, 'email': None
+            } for i in range(start, min(start + SEED_CHUNK_SIZE, count))])
+
+
+def drop_users(prefix: str):
+    with engine.begin() as connection:
+        connection.execute(User.__table__.delete().where(User.login.startswith(prefix)))
+
+
+def auth_headers() -> dict:
+    return {'Authorization': f'Bearer {create_access_token({"login": ADMIN})}'}
+
+
+def median_ms(func, repeats: int = REPEATS) -> float:
+    timings = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings)
+
+
+@scenario('list')
+def list_latency(client: TestClient):
+    prefix, headers = 'bench_list_', auth_headers()
+    seed_users(prefix, max(LIST_SIZES))
+    hash_ms = median_ms(lambda: hash('secret'), repeats=3)
+    print(f'Один bcrypt-хэш: {hash_ms:.1f} мс')
+    try:
+        for size in LIST_SIZES:
+            params = {'limit': size, 'after': prefix}
+            elapsed = median_ms(lambda: client.get('/users', params=params, headers=headers).raise_for_status())
+            print(
+                f'GET /users, {size} строк: {elapsed:.1f} мс ({elapsed / size * 1000:.1f} мкс на строку); '
+                f'прежний хэш на каждую строку добавил бы ~{hash_ms * size / 1000:.1f} с'
+            )
+    finally:
+        drop_users(prefix)
+
+
+async def search_warm_bench(tasks: BackgroundTasks, legacy: bool = False) -> list:
+    async with AsyncSessionLocal() as db:
+        users = await get_users_by_name_and_surname('Warm', 'Bench', tasks, ADMIN, db)
+    if legacy:
+        for user in users:
+            cache_login = f'user_login: {user["login"]}'
+            if not await user_cache.redis.exists(cache_login):
+                await user_cache.redis.set(cache_login, json.dumps(user), ex=EXPIRE_SECONDS)
+    return users
+
+
+async def drop_warm_keys(prefix: str, count: int):
+    logins = [f'{prefix}{i:08d}' for i in range(count)]
+    await user_cache.redis.delete(search_key(user_cache.codec, 'Warm', 'Bench'))
+    for start in range(0, count, SEED_CHUNK_SIZE):
+        chunk = logins[start:start + SEED_CHUNK_SIZE]
+        await user_cache.redis.delete(
+            *[user_cache.key(login) for login in chunk], *[f'user_login: {login}' for login in chunk]
+        )
+
+
+@scenario('warm')
+def warm_latency(client: TestClient):
+    prefix = 'bench_warm_'
+    seed_users(prefix, WARM_USERS, name=lambda i: 'Warm', surname=lambda i: 'Bench')
+
+    def measure(legacy: bool) -> tuple:
+        tasks = BackgroundTasks()
+        client.portal.call(drop_warm_keys, prefix, WARM_USERS)
+        response_ms = median_ms(lambda: client.portal.call(search_warm_bench, tasks, legacy), repeats=1)
+        background_ms = median_ms(lambda: client.portal.call(tasks), repeats=1)
+        return response_ms, background_ms
+
+    try:
+        for legacy, label in ((True, 'EXISTS/SET на каждого пользователя'), (False, 'конвейер после ответа')):
+            timings = [measure(legacy) for _ in range(REPEATS)]
+            response_ms = statistics.median(timing[0] for timing in timings)
+            background_ms = statistics.median(timing[1] for timing in timings)
+            print(
+                f'Поиск {WARM_USERS} пользователей, {label}: ответ за {response_ms:.1f} мс, '
+                f'фоновый прогрев {background_ms:.1f} мс'
+            )
+    finally:
+        client.portal.call(drop_warm_keys, prefix, WARM_USERS)
+        drop_users(prefix)
+
+
+class LegacyCodec:
+    name = 'json.dumps'
+
+    def key(self, login: str) -> str:
+        return f'user_login: {login}'
+
+    def dumps(self, entry: dict) -> bytes:
+        return json.dumps(entry['user']).encode()
+
+    def loads(self, data: bytes) -> dict:
+        return {'user': json.loads(data)}
+
+
+class VersionedCodec:
+    def __init__(self, codec):
+        self.codec = codec
+        self.name = codec.name
+        self.dumps = codec.dumps
+        self.loads = codec.loads
+
+    def key(self, login: str) -> str:
+        return user_key(self.codec, login)
+
+
+async def redis_used_memory() -> int:
+    return (await user_cache.redis.info('memory'))['used_memory']
+
+
+async def store_entries(entries: list):
+    for start in range(0, len(entries), SEED_CHUNK_SIZE):
+        pipeline = user_cache.redis.pipeline(transaction=False)
+        for key, value in entries[start:start + SEED_CHUNK_SIZE]:
+            pipeline.set(key, value)
+        await pipeline.execute()
+
+
+async def drop_entries(entries: list):
+    for start in range(0, len(entries), SEED_CHUNK_SIZE):
+        await user_cache.redis.delete(*[key for key, _ in entries[start:start + SEED_CHUNK_SIZE]])
+
+
+@scenario('codec')
+def codec_footprint(client: TestClient):
+    users = [{
+        'login': f'user{i:08d}', 'password': PASSWORD, 'name': 'Иван', 'surname': f'Иванов{i % 1000}',
+        'age': 20 + i % 50, 'email': f'user{i}@example.com' if i % 2 else None
+    } for i in range(CACHE_USERS)]
+    expires_at = time.time() + EXPIRE_SECONDS
+    for codec in (LegacyCodec(), VersionedCodec(JsonCodec()), VersionedCodec(MsgpackCodec())):
+        started = time.perf_counter()
+        entries = [
+            (codec.key(user['login']), codec.dumps({'user': user, 'delta': 0.002, 'expires_at': expires_at}))
+            for user in users
+        ]
+        encode_seconds = time.perf_counter() - started
+        started = time.perf_counter()
+        for _, value in entries:
+            codec.loads(value)
+        decode_seconds = time.perf_counter() - started
+        size = sum(len(key) + len(value) for key, value in entries)
+        print(
+            f'{codec.name}: {size / CACHE_USERS:.1f} байт на пользователя (ключ и значение), '
+            f'кодирование {CACHE_USERS / encode_seconds:.0f}/с, декодирование {CACHE_USERS / decode_seconds:.0f}/с'
+        )
+        if REDIS_URL.startswith('fakeredis'):
+            continue
+        before = client.portal.call(redis_used_memory)
+        client.portal.call(store_entries, entries)
+        used = client.portal.call(redis_used_memory) - before
+        client.portal.call(drop_entries, entries)
+        print(f'{codec.name}: Redis занял {used / 2 ** 20:.1f} МиБ на {CACHE_USERS} пользователей')
+
+
+def surname_query(i: int):
+    return select(User).where(and_(User.name == 'Conc', User.surname == f'S{i % 100}'))
+
+
+async def query_async(i: int):
+    async with AsyncSessionLocal() as db:
+        return (await db.scalars(surname_query(i))).all()
+
+
+async def query_blocking(i: int):
+    with Session(engine) as db:
+        return db.scalars(surname_query(i)).all()
+
+
+async def run_in_flight(query, in_flight: int) -> tuple:
+    semaphore, max_lag = asyncio.Semaphore(in_flight), 0.0
+
+    async def request(i: int):
+        async with semaphore:
+            await query(i)
+
+    async def watch_loop():
+        nonlocal max_lag
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(0.001)
+            max_lag = max(max_lag, time.perf_counter() - started - 0.001)
+
+    watcher = asyncio.create_task(watch_loop())
+    started = time.perf_counter()
+    await asyncio.gather(*(request(i) for i in range(CONCURRENCY_REQUESTS)))
+    rate = CONCURRENCY_REQUESTS / (time.perf_counter() - started)
+    await asyncio.sleep(0.01)
+    watcher.cancel()
+    return rate, max_lag * 1000
+
+
+@scenario('concurrency')
+def concurrency_scaling(client: TestClient):
+    prefix = 'bench_conc_'
+    seed_users(prefix, CONCURRENCY_USERS, name=lambda i: 'Conc', surname=lambda i: f'S{i % 100}')
+    try:
+        for query, label in ((query_blocking, 'блокирующая сессия'), (query_async, 'асинхронная сессия')):
+            for in_flight in CONCURRENCY:
+                rate, max_lag_ms = client.portal.call(run_in_flight, query, in_flight)
+                print(
+                    f'{label}, {in_flight} запросов одновременно: {rate:.0f} запросов/с, '
+                    f'наибольшая задержка цикла событий {max_lag_ms:.1f} мс'
+                )
+    finally:
+        drop_users(prefix)
+
+
+def peak_rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+async def stream_all() -> int:
+    size = 0
+    async for line in stream_users(None):
+        size += len(line)
+    return size
+
+
+async def materialize_all() -> int:
+    async with AsyncSessionLocal() as db:
+        users = (await db.scalars(select(User).order_by(User.login))).all()
+        public = [{key: value for key, value in serialize(user).items() if key != 'password'} for user in users]
+        return len(json.dumps(public, ensure_ascii=False))
+
+
+@scenario('stream')
+def stream_memory(client: TestClient):
+    prefix = 'bench_stream_'
+    seed_users(prefix, STREAM_ROWS)
+    try:
+        # ru_maxrss only grows, so the bounded streaming mode has to run first
+        for load, label in ((stream_all, 'поток NDJSON'), (materialize_all, 'вся таблица в памяти')):
+            before = peak_rss_mb()
+            started = time.perf_counter()
+            size = client.portal.call(load)
+            elapsed = time.perf_counter() - started
+            print(
+                f'{label}: {size / 2 ** 20:.1f} МиБ ответа за {elapsed:.1f} с, '
+                f'пиковый RSS вырос на {peak_rss_mb() - before:.1f} МиБ (до {peak_rss_mb():.1f} МиБ)'
+            )
+    finally:
+        drop_users(prefix)
+
+
+def explain(query) -> list:
+    sql = str(query.compile(dialect=engine.dialect, compile_kwargs={'literal_binds': True}))
+    prefix = 'EXPLAIN QUERY PLAN' if engine.dialect.name == 'sqlite' else 'EXPLAIN ANALYZE'
+    with engine.connect() as connection:
+        return [row[-1] for row in connection.exec_driver_sql(f'{prefix} {sql}')]
+
+
+@scenario('search')
+def search_plans(client: TestClient):
+    prefix, headers, rng = 'bench_search_', auth_headers(), random.Random(15)
+    seed_users(
+        prefix, SEARCH_ROWS,
+        name=lambda i: f'{rng.choice(NAMES)}{i % 97}', surname=lambda i: f'{rng.choice(SURNAMES)}{i % 89}'
+    )
+    with engine.begin() as connection:
+        connection.execute(text('ANALYZE'))
+    try:
+        for name_mask, surname_mask in SEARCH_MASKS:
+            params = {'name_mask': name_mask, 'surname_mask': surname_mask, 'limit': 100}
+            elapsed = median_ms(lambda: client.get('/users/search', params=params, headers=headers))
+            print(f'name_mask={name_mask} surname_mask={surname_mask}: {elapsed:.1f} мс')
+            for line in explain(mask_search_query(name_mask, surname_mask, 100)):
+                print(f'    {line}')
+    finally:
+        drop_users(prefix)
+
+
+def compress(data: bytes) -> bytes:
+    return lz4.frame.compress(data) if lz4 is not None else zlib.compress(data)
+
+
+@scenario('events')
+def event_formats(client: TestClient):
+    rng, alphabet = random.Random(21), './ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789'
+    events = [('update', {
+        'login': f'user{i:08d}', 'password': '$2b$12$' + ''.join(rng.choices(alphabet, k=53)), 'name': 'Иван', 'surname': f'Иванов{i % 1000}',
+        'age': 20 + i % 50, 'email': f'user{i}@example.com', 'old_login': f'user{i:08d}'
+    }) for i in range(EVENTS)]
+    compression = 'lz4' if lz4 is not None else 'gzip'
+    for event_format in ('json', 'msgpack'):
+        started = time.perf_counter()
+        payloads = [encode_event(action, data, event_format) for action, data in events]
+        encode_seconds = time.perf_counter() - started
+        started = time.perf_counter()
+        for payload in payloads:
+            decode_event(payload)
+        decode_seconds = time.perf_counter() - started
+        size = sum(len(payload) for payload in payloads)
+        compressed = sum(
+            len(compress(b''.join(payloads[start:start + EVENT_BATCH])))
+            for start in range(0, len(payloads), EVENT_BATCH)
+        )
+        print(
+            f'{event_format}: {size / EVENTS:.1f} байт на событие, {compressed / EVENTS:.1f} после сжатия {compression} '
+            f'пачками по {EVENT_BATCH}, кодирование {EVENTS / encode_seconds:.0f}/с, '
+            f'декодирование {EVENTS / decode_seconds:.0f}/с'
+        )
+
+
+if __name__ == '__main__':
+    with TestClient(app) as client:
+        for name in sys.argv[1:] or scenarios:
+            print(f'== {name}')
+            scenarios[name](client)
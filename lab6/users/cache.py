@@ -0,0 +1,425 @@
+from collections import OrderedDict
+from redis.exceptions import LockError
+import asyncio
+import hashlib
+import json
+import logging
+import math
+import random
+import time
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+logger = logging.getLogger(__name__)
+
+
+class LocalCache:
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at <= time.monotonic():
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return value
+
+    def set(self, key, value):
+        self.entries[key] = (value, time.monotonic() + self.ttl)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def delete(self, key):
+        self.entries.pop(key, None)
+
+    def clear(self):
+        self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class TierStats:
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+
+    def as_dict(self) -> dict:
+        requests = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': round(self.hits / requests, 4) if requests else 0.0,
+        }
+
+
+class JsonCodec:
+    name = 'json'
+    version = 1
+
+    def dumps(self, entry: dict) -> bytes:
+        return json.dumps(entry, separators=(',', ':')).encode()
+
+    def loads(self, data: bytes) -> dict:
+        return json.loads(data)
+
+    def dumps_users(self, users: list) -> bytes:
+        return json.dumps(users, separators=(',', ':')).encode()
+
+    def loads_users(self, data: bytes) -> list:
+        return json.loads(data)
+
+
+class MsgpackCodec:
+    name = 'msgpack'
+    version = 2
+    fields = ('login', 'password', 'name', 'surname', 'age', 'email')
+
+    def dumps(self, entry: dict) -> bytes:
+        user = entry['user']
+        return msgpack.packb([user.get(field) for field in self.fields] + [entry['delta'], entry['expires_at']])
+
+    def loads(self, data: bytes) -> dict:
+        *values, delta, expires_at = msgpack.unpackb(data)
+        return {'user': dict(zip(self.fields, values)), 'delta': delta, 'expires_at': expires_at}
+
+    def dumps_users(self, users: list) -> bytes:
+        return msgpack.packb([[user.get(field) for field in self.fields] for user in users])
+
+    def loads_users(self, data: bytes) -> list:
+        return [dict(zip(self.fields, values)) for values in msgpack.unpackb(data)]
+
+
+CODECS = (JsonCodec, MsgpackCodec)
+
+
+def make_codec(name: str):
+    if name == 'msgpack' and msgpack is not None:
+        return MsgpackCodec()
+    return JsonCodec()
+
+
+def user_key(codec, login: str) -> str:
+    return f'u:{codec.version}:{login}'
+
+
+def missing_key(login: str) -> str:
+    return f'um:{login}'
+
+
+def search_key(codec, name: str, surname: str) -> str:
+    name, surname = name.strip(), surname.strip()
+    return f's:{codec.version}:{len(name)}:{name}:{surname}'
+
+
+def search_generation_key(name: str, surname: str) -> str:
+    name, surname = name.strip(), surname.strip()
+    return f'sg:{len(name)}:{name}:{surname}'
+
+
+SEARCH_GENERATION_SECONDS = 24 * 60 * 60
+FILL_SEARCH_SCRIPT = '''
+if (redis.call('GET', KEYS[2]) or '') == ARGV[1] then
+    redis.call('SET', KEYS[1], ARGV[2], 'EX', ARGV[3])
+    return 1
+end
+return 0
+'''
+
+ADD_BLOOM_BITS_SCRIPT = '''
+local building = redis.call('EXISTS', KEYS[2]) == 1
+for _, position in ipairs(ARGV) do
+    redis.call('SETBIT', KEYS[1], position, 1)
+    if building then
+        redis.call('SETBIT', KEYS[2], position, 1)
+    end
+end
+return 0
+'''
+
+
+class BloomFilter:
+    def __init__(self, key: str, size_bits: int, hashes: int):
+        self.key = key
+        self.ready_key = f'{key}:ready'
+        self.building_key = f'{key}:building'
+        self.size_bits = size_bits
+        self.hashes = hashes
+
+    def positions(self, login: str) -> list:
+        digest = hashlib.sha256(login.encode()).digest()
+        first = int.from_bytes(digest[:8], 'big')
+        second = int.from_bytes(digest[8:16], 'big') | 1
+        return [(first + i * second) % self.size_bits for i in range(self.hashes)]
+
+    def add_many(self, redis_client, logins):
+        positions = [position for login in logins for position in self.positions(login)]
+        if positions:
+            redis_client.eval(ADD_BLOOM_BITS_SCRIPT, 2, self.key, self.building_key, *positions)
+
+    def rebuild(self, redis_client, logins):
+        redis_client.delete(self.building_key)
+        redis_client.setbit(self.building_key, self.size_bits - 1, 0)
+        pipeline = redis_client.pipeline(transaction=False)
+        for login in logins:
+            for position in self.positions(login):
+                pipeline.setbit(self.building_key, position, 1)
+        pipeline.execute()
+        redis_client.rename(self.building_key, self.key)
+        redis_client.set(self.ready_key, 1)
+
+    async def might_contain(self, redis_client, login: str) -> bool:
+        pipeline = redis_client.pipeline(transaction=False)
+        pipeline.get(self.ready_key)
+        for position in self.positions(login):
+            pipeline.getbit(self.key, position)
+        ready, *bits = await pipeline.execute()
+        return ready is None or all(bits)
+
+
+class CacheInvalidator:
+    def __init__(self, redis_client, bloom: BloomFilter = None, channel: str = 'user_cache_invalidation'):
+        self.redis = redis_client
+        self.bloom = bloom
+        self.channel = channel
+
+    def mark_existing(self, login: str):
+        self.mark_existing_many([login])
+
+    def mark_existing_many(self, logins: list):
+        if self.bloom is not None:
+            self.bloom.add_many(self.redis, logins)
+        self.invalidate_users(logins)
+
+    def invalidate_users(self, logins):
+        pipeline = self.redis.pipeline(transaction=False)
+        for login in logins:
+            pipeline.delete(*[user_key(codec, login) for codec in CODECS], missing_key(login))
+            pipeline.publish(self.channel, login)
+        pipeline.execute()
+
+    def add_existing(self, logins):
+        if self.bloom is not None:
+            self.bloom.add_many(self.redis, logins)
+
+    def rebuild_bloom(self, logins):
+        if self.bloom is not None:
+            self.bloom.rebuild(self.redis, logins)
+
+    def invalidate_search(self, pairs):
+        pairs = {(name or '', surname or '') for name, surname in pairs}
+        if not pairs:
+            return
+        pipeline = self.redis.pipeline(transaction=False)
+        for name, surname in pairs:
+            pipeline.incr(search_generation_key(name, surname))
+            pipeline.expire(search_generation_key(name, surname), SEARCH_GENERATION_SECONDS)
+            pipeline.delete(*[search_key(codec, name, surname) for codec in CODECS])
+        pipeline.execute()
+
+
+class UserCache:
+    MISSING = object()
+
+    def __init__(self, redis_client, expire_seconds: int, local_size: int, local_ttl: float,
+                 channel: str = 'user_cache_invalidation', lock_seconds: float = 5.0,
+                 lock_wait_seconds: float = 1.0, early_refresh_beta: float = 1.0,
+                 negative_expire_seconds: int = 30, bloom: BloomFilter = None, codec=None,
+                 pubsub_client=None):
+        self.redis = redis_client
+        self.pubsub_client = pubsub_client or redis_client
+        self.codec = codec or JsonCodec()
+        self.expire_seconds = expire_seconds
+        self.negative_expire_seconds = negative_expire_seconds
+        self.bloom = bloom
+        self.local = LocalCache(local_size, local_ttl)
+        self.channel = channel
+        self.lock_seconds = lock_seconds
+        self.lock_wait_seconds = lock_wait_seconds
+        self.early_refresh_beta = early_refresh_beta
+        self.inflight = {}
+        self.load_seconds = 0.01
+        self.local_stats = TierStats()
+        self.redis_stats = TierStats()
+        self.loads = 0
+        self.coalesced = 0
+        self.early_refreshes = 0
+        self.negative_hits = 0
+        self.bloom_rejects = 0
+        self.search_stats = TierStats()
+        self.fill_search_script = self.redis.register_script(FILL_SEARCH_SCRIPT)
+        self.listener = None
+
+    def key(self, login: str) -> str:
+        return user_key(self.codec, login)
+
+    def encode(self, user: dict, load_seconds: float) -> bytes:
+        return self.codec.dumps({
+            'user': user,
+            'delta': load_seconds,
+            'expires_at': time.time() + self.expire_seconds
+        })
+
+    def decode(self, cached: bytes) -> dict:
+        return self.codec.loads(cached)
+
+    def should_refresh(self, entry: dict) -> bool:
+        remaining = entry['expires_at'] - time.time()
+        return entry['delta'] * self.early_refresh_beta * -math.log(1.0 - random.random()) >= remaining
+
+    async def get_or_load(self, login: str, loader):
+        if (user := self.local.get(login)) is not None:
+            self.local_stats.hits += 1
+            if user is self.MISSING:
+                self.negative_hits += 1
+                return None
+            return user
+        self.local_stats.misses += 1
+        cached, missing = await self.redis.mget(self.key(login), missing_key(login))
+        if cached is not None:
+            self.redis_stats.hits += 1
+            entry = self.decode(cached)
+            if self.should_refresh(entry) and login not in self.inflight:
+                self.early_refreshes += 1
+                self.load(login, loader)
+            self.local.set(login, entry['user'])
+            return entry['user']
+        if missing is not None:
+            self.redis_stats.hits += 1
+            self.negative_hits += 1
+            self.local.set(login, self.MISSING)
+            return None
+        self.redis_stats.misses += 1
+        if self.bloom is not None and not await self.bloom.might_contain(self.redis, login):
+            self.bloom_rejects += 1
+            await self.remember_missing(login)
+            return None
+        return await asyncio.shield(self.load(login, loader))
+
+    async def remember_missing(self, login: str):
+        await self.redis.set(missing_key(login), 1, ex=self.negative_expire_seconds)
+        self.local.set(login, self.MISSING)
+
+    def load(self, login: str, loader) -> asyncio.Task:
+        if (task := self.inflight.get(login)) is not None:
+            self.coalesced += 1
+            return task
+        task = asyncio.ensure_future(self.load_with_lock(login, loader))
+        self.inflight[login] = task
+        task.add_done_callback(lambda _: self.inflight.pop(login, None))
+        return task
+
+    async def load_with_lock(self, login: str, loader):
+        lock = self.redis.lock(f'lock:{self.key(login)}', timeout=self.lock_seconds)
+        if await lock.acquire(blocking=False):
+            try:
+                return await self.fill(login, loader)
+            finally:
+                try:
+                    await lock.release()
+                except LockError:
+                    pass
+        deadline = time.monotonic() + self.lock_wait_seconds
+        while time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+            cached, missing = await self.redis.mget(self.key(login), missing_key(login))
+            if cached is not None:
+                return self.decode(cached)['user']
+            if missing is not None:
+                return None
+        return await self.fill(login, loader)
+
+    async def fill(self, login: str, loader):
+        started = time.monotonic()
+        user = await loader(login)
+        self.loads += 1
+        self.load_seconds = time.monotonic() - started
+        if user is not None:
+            await self.redis.set(self.key(login), self.encode(user, self.load_seconds), ex=self.expire_seconds)
+            self.local.set(login, user)
+        else:
+            await self.remember_missing(login)
+        return user
+
+    async def warm(self, users: list, batch_size: int = 1000):
+        for start in range(0, len(users), batch_size):
+            pipeline = self.redis.pipeline(transaction=False)
+            for user in users[start:start + batch_size]:
+                pipeline.set(
+                    self.key(user['login']), self.encode(user, self.load_seconds),
+                    ex=self.expire_seconds, nx=True
+                )
+            await pipeline.execute()
+
+    async def get_search(self, name: str, surname: str):
+        cached, generation = await self.redis.mget(
+            search_key(self.codec, name, surname), search_generation_key(name, surname)
+        )
+        if cached is None:
+            self.search_stats.misses += 1
+            return None, generation or b''
+        self.search_stats.hits += 1
+        return self.codec.loads_users(cached), generation or b''
+
+    async def set_search(self, name: str, surname: str, users: list, generation: bytes):
+        await self.fill_search_script(
+            keys=[search_key(self.codec, name, surname), search_generation_key(name, surname)],
+            args=[generation, self.codec.dumps_users(users), self.expire_seconds]
+        )
+
+    def handle_invalidation(self, message: bytes):
+        self.local.delete(message.decode())
+
+    async def listen_invalidations(self):
+        while True:
+            try:
+                async with self.pubsub_client.pubsub(ignore_subscribe_messages=True) as pubsub:
+                    await pubsub.subscribe(self.channel)
+                    async for message in pubsub.listen():
+                        self.handle_invalidation(message['data'])
+            except asyncio.CancelledError:
+                raise
+            except Exception as error:
+                logger.warning(f'Cache invalidation listener error: {error}')
+                self.local.clear()
+                await asyncio.sleep(1)
+
+    def start_listener(self):
+        if self.listener is None:
+            self.listener = asyncio.ensure_future(self.listen_invalidations())
+
+    def stats(self) -> dict:
+        return {
+            'codec': self.codec.name,
+            'local': {**self.local_stats.as_dict(), 'size': len(self.local)},
+            'redis': self.redis_stats.as_dict(),
+            'search': self.search_stats.as_dict(),
+            'loads': self.loads,
+            'coalesced': self.coalesced,
+            'early_refreshes': self.early_refreshes,
+            'negative_hits': self.negative_hits,
+            'bloom_rejects': self.bloom_rejects,
+        }
+
+
+def pool_stats(redis_client) -> dict:
+    pool = redis_client.connection_pool
+    in_use = len(getattr(pool, '_in_use_connections', ()))
+    available = len(getattr(pool, '_available_connections', ()))
+    max_connections = getattr(pool, 'max_connections', None)
+    return {
+        'max_connections': max_connections,
+        'in_use': in_use,
+        'available': available,
+        'utilization': round(in_use / max_connections, 4) if max_connections else 0.0,
+    }
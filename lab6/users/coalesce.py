@@ -0,0 +1,89 @@
+ROW_FIELDS = ('login', 'password', 'name', 'surname', 'age', 'email')
+EMIT_ORDER = ('update', 'create', 'delete')
+
+ABSENT = 'absent'
+ROW = 'row'
+INSERT = 'insert'
+UPDATE = 'update'
+MERGE = 'merge'
+
+
+def user_fields(data) -> dict:
+    return {field: data.get(field) for field in ROW_FIELDS}
+
+
+def exists(state):
+    if state is None or state[0] == UPDATE:
+        return None
+    return state[0] != ABSENT
+
+
+def after_create(state, row: dict):
+    if state is None:
+        return INSERT, row
+    if state[0] == ABSENT:
+        return ROW, row
+    if state[0] == UPDATE:
+        return MERGE, row, state[1]
+    return state
+
+
+def after_update(state, row: dict):
+    if state is None or state[0] == UPDATE:
+        return UPDATE, row
+    if state[0] == ABSENT:
+        return state
+    return ROW, row
+
+
+def materialize(login: str, state) -> list:
+    kind = state[0]
+    if kind == ABSENT:
+        return [('delete', {'login': login})]
+    if kind == INSERT:
+        return [('create', state[1])]
+    if kind == UPDATE:
+        return [('update', dict(state[1], old_login=login))]
+    if kind == ROW:
+        return [('update', dict(state[1], old_login=login)), ('create', state[1])]
+    return [('update', dict(state[2], old_login=login)), ('create', state[1])]
+
+
+def coalesce_events(events) -> list:
+    states, output = {}, []
+
+    def flush(logins):
+        for login in logins:
+            if login in states:
+                output.extend(materialize(login, states.pop(login)))
+
+    for action, data in events:
+        if action in ('create', 'bulk_create'):
+            for item in data if action == 'bulk_create' else [data]:
+                states[item['login']] = after_create(states.get(item['login']), user_fields(item))
+
+        elif action == 'delete':
+            states[data['login']] = (ABSENT,)
+
+        elif action == 'rehash':
+            flush([data['login']])
+            output.append((action, data))
+
+        elif action == 'update':
+            old_login, login = data['old_login'], data['login']
+            if old_login == login:
+                states[login] = after_update(states.get(login), user_fields(data))
+                continue
+            source, target = exists(states.get(old_login)), exists(states.get(login))
+            if source is False or (source and target):
+                continue
+            if source and target is False:
+                states[old_login] = (ABSENT,)
+                states[login] = (ROW, user_fields(data))
+                continue
+            flush([old_login, login])
+            output.append((action, data))
+
+    tail = [event for login, state in states.items() for event in materialize(login, state)]
+    output.extend(sorted(tail, key=lambda event: EMIT_ORDER.index(event[0])))
+    return output
@@ -0,0 +1,41 @@
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+os.environ.setdefault('DATABASE_URL', 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'users.db'))
+os.environ.setdefault('REDIS_URL', 'fakeredis://')
+os.environ.setdefault('BCRYPT_ROUNDS', '4')
+
+import pytest
+
+
+@pytest.fixture(scope='session')
+def client():
+    from fastapi.testclient import TestClient
+    from users import app
+    with TestClient(app) as client:
+        yield client
+
+
+@pytest.fixture
+def admin_headers():
+    from users import ADMIN, create_access_token
+    return {'Authorization': f'Bearer {create_access_token({"login": ADMIN})}'}
+
+
+@pytest.fixture
+def add_users():
+    from sqlalchemy.orm import Session
+    from users import User, engine, hash
+    password = hash('secret')
+
+    def add(*logins):
+        with Session(engine) as db:
+            db.add_all([
+                User(login=login, password=password, name='Иван', surname='Иванов', age=30)
+                for login in logins
+            ])
+            db.commit()
+
+    return add
@@ -1,9 +1,18 @@
-from sqlalchemy import create_engine
+from sqlalchemy import bindparam, create_engine, delete, select, update
+from sqlalchemy.exc import DBAPIError, InterfaceError, OperationalError
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.orm import sessionmaker
-from confluent_kafka import Consumer, KafkaException
-from users import User, Base
-import json
+from confluent_kafka import Consumer, KafkaException, TopicPartition
+from users import User, Base, ensure_hashed, bloom, REDIS_URL
+from cache import CacheInvalidator
+from events import decode_event
+from coalesce import coalesce_events
+import redis
+import logging
 import os
+import queue
+import threading
+import time
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -14,18 +23,157 @@ SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 KAFKA_BROKER = os.getenv('KAFKA_BROKER', 'kafka:9092')
 GROUP_ID = 'my_group'
+CONSUMER_BATCH_MODE = os.getenv('CONSUMER_BATCH_MODE', '1') == '1'
+CONSUMER_BATCH_SIZE = int(os.getenv('CONSUMER_BATCH_SIZE', '500'))
+CONSUMER_BATCH_TIMEOUT_MS = int(os.getenv('CONSUMER_BATCH_TIMEOUT_MS', '100'))
+CONSUMER_WORKERS_MODE = os.getenv('CONSUMER_WORKERS_MODE', '0') == '1'
+CONSUMER_QUEUE_SIZE = int(os.getenv('CONSUMER_QUEUE_SIZE', '5000'))
+CONSUMER_COALESCE = os.getenv('CONSUMER_COALESCE', '1') == '1'
+CONSUMER_RETRY_SECONDS = float(os.getenv('CONSUMER_RETRY_SECONDS', '5'))
+
+
+def create_redis_client(url: str):
+    if url.startswith('fakeredis://'):
+        import fakeredis
+        return fakeredis.FakeRedis()
+    return redis.from_url(url)
+
+
+cache_invalidator = CacheInvalidator(create_redis_client(REDIS_URL), bloom)
+
+
+def insert_ignoring_existing():
+    dialect = postgresql if engine.dialect.name == 'postgresql' else sqlite
+    return dialect.insert(User).on_conflict_do_nothing(index_elements=['login'])
+
+
+def update_by_old_login():
+    users = User.__table__
+    return update(users).where(users.c.login == bindparam('old_login'))
+
+
+def rehash_if_unchanged():
+    users = User.__table__
+    return update(users).where(
+        users.c.login == bindparam('rehash_login'), users.c.password == bindparam('old_password')
+    ).values(password=bindparam('new_password'))
+
+
+def user_row(data) -> dict:
+    return {
+        'login': data['login'],
+        'password': ensure_hashed(data['password']),
+        'name': data['name'],
+        'surname': data['surname'],
+        'age': data['age'],
+        'email': data.get('email')
+    }
+
+
+class BatchChanges:
+    def __init__(self):
+        self.existing = []
+        self.invalidated = []
+        self.names = []
+
+    def invalidate(self, invalidator: CacheInvalidator):
+        if self.existing:
+            invalidator.mark_existing_many(self.existing)
+        if self.invalidated:
+            invalidator.invalidate_users(self.invalidated)
+        invalidator.invalidate_search(self.names)
+
+
+def event_runs(events) -> list:
+    runs = []
+    for action, data in events:
+        kind = 'create' if action == 'bulk_create' else action
+        items = data if action == 'bulk_create' else [data]
+        if runs and runs[-1][0] == kind:
+            runs[-1][1].extend(items)
+        else:
+            runs.append((kind, list(items)))
+    return runs
+
+
+def current_names(db, logins):
+    return db.execute(select(User.name, User.surname).where(User.login.in_(set(logins)))).all()
+
+
+def apply_run(db, kind: str, items: list, changes: BatchChanges):
+    if kind == 'create':
+        rows = [user_row(item) for item in items]
+        db.execute(insert_ignoring_existing(), rows)
+        changes.existing.extend(row['login'] for row in rows)
+        changes.names.extend((row['name'], row['surname']) for row in rows)
+
+    elif kind == 'update':
+        changes.names.extend(current_names(db, [item['old_login'] for item in items]))
+        rows = [dict(user_row(item), old_login=item['old_login']) for item in items]
+        db.execute(update_by_old_login(), rows)
+        changes.existing.extend(row['login'] for row in rows)
+        changes.invalidated.extend(row['old_login'] for row in rows if row['old_login'] != row['login'])
+        changes.names.extend((row['name'], row['surname']) for row in rows)
+
+    elif kind == 'delete':
+        logins = [item['login'] for item in items]
+        changes.names.extend(current_names(db, logins))
+        db.execute(delete(User.__table__).where(User.__table__.c.login.in_(logins)))
+        changes.invalidated.extend(logins)
+
+    elif kind == 'rehash':
+        db.execute(rehash_if_unchanged(), [{
+            'rehash_login': item['login'],
+            'old_password': item['old_password'],
+            'new_password': item['password']
+        } for item in items])
+        changes.invalidated.extend(item['login'] for item in items)
+
+
+def database_unavailable(error: Exception) -> bool:
+    return isinstance(error, (OperationalError, InterfaceError)) or (
+        isinstance(error, DBAPIError) and error.connection_invalidated
+    )
+
+
+def process_batch(db, messages):
+    events = []
+    for message in messages:
+        try:
+            events.append(decode_event(message.value()))
+        except Exception as e:
+            logger.error(f'Error decoding message: {str(e)}')
+    if CONSUMER_COALESCE:
+        events = coalesce_events(events)
+
+    changes = BatchChanges()
+    try:
+        for kind, items in event_runs(events):
+            apply_run(db, kind, items, changes)
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        if database_unavailable(e):
+            raise
+        logger.error(f'Error processing batch, applying messages one by one: {str(e)}')
+        for message in messages:
+            process_message(db, message)
+        return
+
+    try:
+        changes.invalidate(cache_invalidator)
+    except Exception as e:
+        logger.error(f'Error invalidating cache: {str(e)}')
 
 
 def process_message(db, message):
     try:
-        msg_value = json.loads(message.value().decode('utf-8'))
-        action = msg_value['action']
-        data = msg_value['data']
+        action, data = decode_event(message.value())
 
         if action == 'create':
             new_user = User(
                 login=data['login'],
-                password=data['password'],
+                password=ensure_hashed(data['password']),
                 name=data['name'],
                 surname=data['surname'],
                 age=data['age'],
@@ -34,27 +182,220 @@ def process_message(db, message):
             db.add(new_user)
             db.commit()
             db.refresh(new_user)
+            cache_invalidator.mark_existing(data['login'])
+            cache_invalidator.invalidate_search([(data['name'], data['surname'])])
 
         elif action == 'update':
             potential = db.query(User).filter(User.login == data['old_login'])
+            previous = potential.first()
+            changed_names = [(data['name'], data['surname'])]
+            if previous is not None:
+                changed_names.append((previous.name, previous.surname))
             potential.update({
                 'login': data['login'],
-                'password': data['password'],
+                'password': ensure_hashed(data['password']),
                 'name': data['name'],
                 'surname': data['surname'],
                 'age': data['age'],
                 'email': data['email']
             })
             db.commit()
+            cache_invalidator.mark_existing(data['login'])
+            if data['old_login'] != data['login']:
+                cache_invalidator.invalidate_users([data['old_login']])
+            cache_invalidator.invalidate_search(changed_names)
+
+        elif action == 'bulk_create':
+            rows = [{
+                'login': item['login'],
+                'password': ensure_hashed(item['password']),
+                'name': item['name'],
+                'surname': item['surname'],
+                'age': item['age'],
+                'email': item.get('email')
+            } for item in data]
+            db.execute(insert_ignoring_existing(), rows)
+            db.commit()
+            cache_invalidator.mark_existing_many([row['login'] for row in rows])
+            cache_invalidator.invalidate_search([(row['name'], row['surname']) for row in rows])
+
+        elif action == 'rehash':
+            db.query(User).filter(User.login == data['login'], User.password == data['old_password']).update({
+                'password': data['password']
+            })
+            db.commit()
+            cache_invalidator.invalidate_users([data['login']])
 
         elif action == 'delete':
             user = db.query(User).filter(User.login == data['login']).first()
             db.delete(user)
             db.commit()
+            cache_invalidator.invalidate_users([data['login']])
+            cache_invalidator.invalidate_search([(user.name, user.surname)])
 
     except Exception as e:
-        logger.error(f'Error processing message: {str(e)}')
         db.rollback()
+        if database_unavailable(e):
+            raise
+        logger.error(f'Error processing message: {str(e)}')
+
+
+def commit_offsets(consumer: Consumer):
+    try:
+        consumer.commit(asynchronous=False)
+    except KafkaException as error:
+        logger.error(f'Error committing offsets: {error}')
+
+
+def rewind(consumer: Consumer, messages):
+    first = {}
+    for message in messages:
+        first.setdefault((message.topic(), message.partition()), message.offset())
+    for (topic, partition), offset in first.items():
+        consumer.seek(TopicPartition(topic, partition, offset))
+
+
+def consume_batch(consumer: Consumer, db):
+    messages = consumer.consume(CONSUMER_BATCH_SIZE, CONSUMER_BATCH_TIMEOUT_MS / 1000)
+    if not (batch := [msg for msg in messages if not skip_error(msg)]):
+        return
+    try:
+        process_batch(db, batch)
+    except DBAPIError as error:
+        logger.error(f'Database unavailable, batch will be retried: {error}')
+        rewind(consumer, batch)
+        time.sleep(CONSUMER_RETRY_SECONDS)
+        return
+    commit_offsets(consumer)
+
+
+def skip_error(msg) -> bool:
+    if error := msg.error():
+        print(error.code())
+        if error.code() == 3:
+            return True
+        raise KafkaException(error)
+    return False
+
+
+class PartitionWorker:
+    def __init__(self, partition: TopicPartition, batch_size: int):
+        self.partition = partition
+        self.batch_size = batch_size
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.processed = None
+        self.committed = None
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def submit(self, message):
+        self.queue.put(message)
+
+    def next_batch(self):
+        if (message := self.queue.get()) is None:
+            return None
+        batch = [message]
+        while len(batch) < self.batch_size:
+            try:
+                message = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if message is None:
+                self.queue.put(None)
+                break
+            batch.append(message)
+        return batch
+
+    def run(self):
+        db = SessionLocal()
+        try:
+            while (batch := self.next_batch()) is not None:
+                process_batch(db, batch)
+                with self.lock:
+                    self.processed = batch[-1].offset() + 1
+        except Exception:
+            logger.exception(f'Worker for partition {self.partition.partition} stopped')
+            raise
+        finally:
+            db.close()
+
+    def alive(self) -> bool:
+        return self.thread.is_alive()
+
+    def pending_offset(self):
+        with self.lock:
+            return None if self.processed == self.committed else self.processed
+
+    def stop(self):
+        self.queue.put(None)
+
+    def join(self):
+        self.thread.join()
+
+
+class PartitionWorkers:
+    def __init__(self, consumer: Consumer, batch_size: int, queue_size: int):
+        self.consumer = consumer
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+        self.workers = {}
+        self.paused = set()
+
+    def on_assign(self, consumer, partitions):
+        for partition in partitions:
+            key = (partition.topic, partition.partition)
+            if key not in self.workers:
+                self.workers[key] = PartitionWorker(TopicPartition(*key), self.batch_size)
+        logger.info(f'Assigned partitions: {sorted(self.workers)}')
+
+    def on_revoke(self, consumer, partitions):
+        keys = [(partition.topic, partition.partition) for partition in partitions]
+        revoked = [self.workers.pop(key) for key in keys if key in self.workers]
+        for worker in revoked:
+            worker.stop()
+        for worker in revoked:
+            worker.join()
+        self.commit(revoked)
+        self.paused.difference_update(keys)
+        logger.info(f'Revoked partitions: {keys}')
+
+    def check_alive(self):
+        for worker in self.workers.values():
+            if not worker.alive():
+                raise RuntimeError(f'Worker for partition {worker.partition.partition} stopped unexpectedly')
+
+    def dispatch(self, message):
+        if (worker := self.workers.get((message.topic(), message.partition()))) is not None:
+            worker.submit(message)
+
+    def throttle(self):
+        for key, worker in self.workers.items():
+            size = worker.queue.qsize()
+            if size >= self.queue_size and key not in self.paused:
+                self.consumer.pause([worker.partition])
+                self.paused.add(key)
+            elif size <= self.queue_size // 2 and key in self.paused:
+                self.consumer.resume([worker.partition])
+                self.paused.discard(key)
+
+    def commit(self, workers=None):
+        pending = []
+        for worker in self.workers.values() if workers is None else workers:
+            if (offset := worker.pending_offset()) is not None:
+                pending.append((worker, offset))
+        if not pending:
+            return
+        try:
+            self.consumer.commit(offsets=[
+                TopicPartition(worker.partition.topic, worker.partition.partition, offset)
+                for worker, offset in pending
+            ], asynchronous=False)
+        except KafkaException as error:
+            logger.error(f'Error committing offsets: {error}')
+            return
+        for worker, offset in pending:
+            worker.committed = offset
 
 
 def consume_messages():
@@ -63,28 +404,46 @@ def consume_messages():
     consumer_config = {
         'bootstrap.servers': KAFKA_BROKER,
         'group.id': GROUP_ID,
-        'auto.offset.reset': 'earliest'
+        'auto.offset.reset': 'earliest',
+        'enable.auto.commit': not (CONSUMER_BATCH_MODE or CONSUMER_WORKERS_MODE)
     }
 
     consumer = Consumer(consumer_config)
-    consumer.subscribe(['user_events'])
+    workers = PartitionWorkers(consumer, CONSUMER_BATCH_SIZE, CONSUMER_QUEUE_SIZE)
+    if CONSUMER_WORKERS_MODE:
+        consumer.subscribe(['user_events'], on_assign=workers.on_assign, on_revoke=workers.on_revoke)
+    else:
+        consumer.subscribe(['user_events'])
 
     db = SessionLocal()
+    cache_invalidator.rebuild_bloom(login for login, in db.query(User.login))
 
     try:
         while True:
+            if CONSUMER_WORKERS_MODE:
+                for msg in consumer.consume(CONSUMER_BATCH_SIZE, CONSUMER_BATCH_TIMEOUT_MS / 1000):
+                    if not skip_error(msg):
+                        workers.dispatch(msg)
+                workers.check_alive()
+                workers.throttle()
+                workers.commit()
+                continue
+            if CONSUMER_BATCH_MODE:
+                consume_batch(consumer, db)
+                continue
             msg = consumer.poll(1.0)
-            if msg is None:
+            if msg is None or skip_error(msg):
                 continue
-            if error := msg.error():
-                print(error.code())
-                if error.code() == 3:
-                    continue
-                raise KafkaException(error)
-            process_message(db, msg)
-
-    except Exception as error:
-        print(f'Error occurred: {error}')
+            try:
+                process_message(db, msg)
+            except DBAPIError as error:
+                logger.error(f'Database unavailable, message will be retried: {error}')
+                rewind(consumer, [msg])
+                time.sleep(CONSUMER_RETRY_SECONDS)
+
+    except Exception:
+        logger.exception('Consumer stopped')
+        raise
     finally:
         consumer.close()
 
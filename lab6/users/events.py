@@ -0,0 +1,152 @@
+from confluent_kafka import KafkaException, Producer
+import asyncio
+import json
+import logging
+import threading
+import zlib
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+logger = logging.getLogger(__name__)
+
+EVENT_MAGIC = b'\xb1'
+EVENT_SCHEMA_VERSION = 1
+ACTIONS = ('create', 'update', 'delete', 'bulk_create', 'rehash')
+USER_FIELDS = ('login', 'password', 'name', 'surname', 'age', 'email', 'old_login', 'old_password')
+
+
+def pack_user(user: dict) -> list:
+    return [user.get(field) for field in USER_FIELDS]
+
+
+def unpack_user(values: list) -> dict:
+    return dict(zip(USER_FIELDS, values))
+
+
+def encode_event(action: str, data, event_format: str = 'msgpack') -> bytes:
+    if event_format != 'msgpack' or msgpack is None:
+        return json.dumps({'action': action, 'data': data}).encode()
+    body = [pack_user(user) for user in data] if action == 'bulk_create' else pack_user(data)
+    return EVENT_MAGIC + bytes([EVENT_SCHEMA_VERSION]) + msgpack.packb([ACTIONS.index(action), body])
+
+
+def decode_event(payload: bytes):
+    if payload[:1] != EVENT_MAGIC:
+        message = json.loads(payload.decode('utf-8'))
+        return message['action'], message['data']
+    if payload[1] != EVENT_SCHEMA_VERSION:
+        raise ValueError(f'Unsupported event schema version: {payload[1]}')
+    code, body = msgpack.unpackb(payload[2:])
+    action = ACTIONS[code]
+    data = [unpack_user(user) for user in body] if action == 'bulk_create' else unpack_user(body)
+    return action, data
+
+
+def partition_for(key: str, partitions: int) -> int:
+    return zlib.crc32(key.encode()) % partitions
+
+
+def topic_partitions(producer: Producer, topic: str, timeout: float = 5):
+    try:
+        metadata = producer.list_topics(topic, timeout=timeout).topics.get(topic)
+    except KafkaException as error:
+        logger.warning(f'Topic metadata unavailable for {topic}: {error}')
+        return None
+    if metadata is None or metadata.error is not None or not metadata.partitions:
+        return None
+    return len(metadata.partitions)
+
+
+def _resolve(future: asyncio.Future, error, message):
+    if future.done():
+        return
+    if error is not None:
+        future.set_exception(KafkaException(error))
+    else:
+        future.set_result(message)
+
+
+class AsyncProducer:
+    def __init__(self, config: dict, topics=(), poll_interval: float = 0.1,
+                 metadata_interval: float = 60.0, metadata_retry: float = 5.0):
+        self.producer = Producer(config)
+        self.topics = list(topics)
+        self.poll_interval = poll_interval
+        self.metadata_interval = metadata_interval
+        self.metadata_retry = metadata_retry
+        self.delivered = 0
+        self.failed = 0
+        self.rejected = 0
+        self.partitions = {}
+        self.running = True
+        self.stopped = threading.Event()
+        self.poller = threading.Thread(target=self.poll_loop, daemon=True)
+        self.poller.start()
+        self.metadata_loader = threading.Thread(target=self.metadata_loop, daemon=True)
+        self.metadata_loader.start()
+
+    def poll_loop(self):
+        while self.running:
+            self.producer.poll(self.poll_interval)
+
+    def metadata_loop(self):
+        while self.running and self.topics:
+            for topic in self.topics:
+                if (partitions := topic_partitions(self.producer, topic)) is not None:
+                    self.partitions[topic] = partitions
+            complete = all(topic in self.partitions for topic in self.topics)
+            self.stopped.wait(self.metadata_interval if complete else self.metadata_retry)
+
+    def partition_count(self, topic: str):
+        return self.partitions.get(topic)
+
+    def partition(self, topic: str, key: str):
+        if (partitions := self.partition_count(topic)) is None:
+            return None
+        return partition_for(key, partitions)
+
+    def produce(self, topic: str, value, key: str = None) -> asyncio.Future:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        future.add_done_callback(self.log_failure)
+
+        def on_delivery(error, message):
+            if error is not None:
+                self.failed += 1
+            else:
+                self.delivered += 1
+            loop.call_soon_threadsafe(_resolve, future, error, message)
+
+        options = {}
+        if key is not None and (partition := self.partition(topic, key)) is not None:
+            options['partition'] = partition
+        try:
+            self.producer.produce(topic, value=value, key=key, on_delivery=on_delivery, **options)
+        except BufferError:
+            self.rejected += 1
+            future.remove_done_callback(self.log_failure)
+            future.cancel()
+            raise
+        return future
+
+    @staticmethod
+    def log_failure(future: asyncio.Future):
+        if not future.cancelled() and (error := future.exception()) is not None:
+            logger.error(f'Message delivery failed: {error}')
+
+    def close(self, timeout: float = 10.0):
+        self.running = False
+        self.stopped.set()
+        self.poller.join()
+        self.producer.flush(timeout)
+
+    def stats(self) -> dict:
+        return {
+            'queued': len(self.producer),
+            'delivered': self.delivered,
+            'failed': self.failed,
+            'rejected': self.rejected,
+        }
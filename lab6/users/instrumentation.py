@@ -0,0 +1,97 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from sqlalchemy import event
+import redis.asyncio
+import logging
+import time
+
+logger = logging.getLogger('request_stats')
+
+
+class RequestStats:
+    kinds = ('sql', 'redis', 'kafka')
+
+    def __init__(self):
+        self.counts = dict.fromkeys(self.kinds, 0)
+        self.seconds = dict.fromkeys(self.kinds, 0.0)
+
+    def record(self, kind: str, seconds: float, count: int = 1):
+        self.counts[kind] += count
+        self.seconds[kind] += seconds
+
+    def header(self) -> str:
+        return ', '.join(
+            f'{kind}={self.counts[kind]};dur={self.seconds[kind] * 1000:.2f}' for kind in self.kinds
+        )
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+current_stats: ContextVar = ContextVar('current_stats', default=None)
+watchers = []
+
+
+def record(kind: str, seconds: float, count: int = 1):
+    if (stats := current_stats.get()) is not None:
+        stats.record(kind, seconds, count)
+    for watcher in watchers:
+        watcher.record(kind, seconds, count)
+
+
+@contextmanager
+def max_queries(limit: int):
+    stats = RequestStats()
+    watchers.append(stats)
+    try:
+        yield stats
+    finally:
+        watchers.remove(stats)
+    if stats.counts['sql'] > limit:
+        raise QueryBudgetExceeded(f'Выполнено {stats.counts["sql"]} SQL-запросов, допустимо {limit}')
+
+
+def instrument_engine(engine):
+    @event.listens_for(engine, 'before_cursor_execute')
+    def before_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+        connection.info.setdefault('query_started', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def after_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+        record('sql', time.perf_counter() - connection.info['query_started'].pop())
+
+
+class InstrumentedPipeline(redis.asyncio.client.Pipeline):
+    async def execute(self, raise_on_error: bool = True):
+        commands = len(self.command_stack)
+        started = time.perf_counter()
+        try:
+            return await super().execute(raise_on_error)
+        finally:
+            record('redis', time.perf_counter() - started, commands)
+
+
+class InstrumentedRedis(redis.asyncio.Redis):
+    async def execute_command(self, *args, **options):
+        started = time.perf_counter()
+        try:
+            return await super().execute_command(*args, **options)
+        finally:
+            record('redis', time.perf_counter() - started)
+
+    def pipeline(self, transaction: bool = True, shard_hint=None):
+        return InstrumentedPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+
+
+@contextmanager
+def timed(kind: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(kind, time.perf_counter() - started)
+
+
+def log_request(method: str, path: str, stats: RequestStats):
+    logger.info(f'{method} {path} {stats.header()}')
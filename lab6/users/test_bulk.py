@@ -0,0 +1,24 @@
+from users import hash
+
+
+def bulk_item(login: str, password: str) -> dict:
+    return {'login': login, 'password': password, 'name': 'Анна', 'surname': 'Смирнова', 'age': 25}
+
+
+def test_bulk_rejects_plaintext_passwords(client, admin_headers):
+    response = client.post('/users/bulk', json=[
+        bulk_item('bulk_plain', 'secret'), bulk_item('bulk_hashed', hash('secret'))
+    ], headers=admin_headers)
+    statuses = [result['status'] for result in response.json()['results']]
+    assert statuses == ['invalid', 'accepted']
+
+
+def test_bulk_checks_existing_logins_in_chunks(client, admin_headers, add_users):
+    add_users('bulk_chunk_7', 'bulk_chunk_2999')
+    password = hash('secret')
+    items = [bulk_item(f'bulk_chunk_{i}', password) for i in range(3000)]
+    response = client.post('/users/bulk', json=items, headers=admin_headers)
+    assert response.status_code == 200
+    exists = {result['login'] for result in response.json()['results'] if result['status'] == 'exists'}
+    assert exists == {'bulk_chunk_7', 'bulk_chunk_2999'}
+    assert response.json()['accepted'] == 2998
@@ -0,0 +1,134 @@
+from cache import BloomFilter, CacheInvalidator, JsonCodec, MsgpackCodec, UserCache, search_key
+import asyncio
+import fakeredis
+
+
+def make_loader(delay: float = 0.1):
+    calls = []
+
+    async def loader(login: str):
+        calls.append(login)
+        await asyncio.sleep(delay)
+        return {'login': login, 'name': 'Иван', 'surname': 'Иванов', 'age': 30, 'email': None}
+
+    return loader, calls
+
+
+def test_concurrent_misses_produce_one_load():
+    async def scenario():
+        cache = UserCache(fakeredis.FakeAsyncRedis(server=fakeredis.FakeServer()), 300, 100, 30)
+        loader, calls = make_loader()
+        users = await asyncio.gather(*(cache.get_or_load('ivan', loader) for _ in range(50)))
+        return users, calls, cache
+
+    users, calls, cache = asyncio.run(scenario())
+    assert calls == ['ivan']
+    assert all(user['login'] == 'ivan' for user in users)
+    assert cache.coalesced == 49
+
+
+def test_concurrent_misses_across_replicas_produce_one_load():
+    async def scenario():
+        server = fakeredis.FakeServer()
+        loader, calls = make_loader()
+        caches = [UserCache(fakeredis.FakeAsyncRedis(server=server), 300, 100, 30) for _ in range(2)]
+        users = await asyncio.gather(*(cache.get_or_load('ivan', loader) for cache in caches for _ in range(25)))
+        return users, calls
+
+    users, calls = asyncio.run(scenario())
+    assert calls == ['ivan']
+    assert all(user['login'] == 'ivan' for user in users)
+
+
+def test_missing_login_is_loaded_once():
+    async def scenario():
+        cache = UserCache(fakeredis.FakeAsyncRedis(server=fakeredis.FakeServer()), 300, 100, 30)
+        calls = []
+
+        async def loader(login: str):
+            calls.append(login)
+            await asyncio.sleep(0.05)
+            return None
+
+        first = await asyncio.gather(*(cache.get_or_load('ghost', loader) for _ in range(20)))
+        second = await cache.get_or_load('ghost', loader)
+        return first, second, calls
+
+    first, second, calls = asyncio.run(scenario())
+    assert calls == ['ghost']
+    assert first == [None] * 20 and second is None
+
+
+def test_consumer_invalidation_drops_local_copy():
+    async def scenario():
+        cache = UserCache(fakeredis.FakeAsyncRedis(server=fakeredis.FakeServer()), 300, 100, 30)
+        loader, calls = make_loader(0)
+        await cache.get_or_load('ivan', loader)
+        cache.handle_invalidation(b'ivan')
+        await cache.redis.delete(cache.key('ivan'))
+        await cache.get_or_load('ivan', loader)
+        return calls
+
+    assert asyncio.run(scenario()) == ['ivan', 'ivan']
+
+
+def test_search_fill_is_skipped_after_concurrent_invalidation():
+    async def scenario():
+        server = fakeredis.FakeServer()
+        cache = UserCache(fakeredis.FakeAsyncRedis(server=server), 300, 100, 30)
+        invalidator = CacheInvalidator(fakeredis.FakeRedis(server=server))
+        stale = [{'login': 'ivan', 'name': 'Иван', 'surname': 'Иванов', 'age': 30, 'email': None}]
+
+        _, generation = await cache.get_search('Иван', 'Иванов')
+        invalidator.invalidate_search([('Иван', 'Иванов')])
+        await cache.set_search('Иван', 'Иванов', stale, generation)
+        raced, _ = await cache.get_search('Иван', 'Иванов')
+
+        _, generation = await cache.get_search('Иван', 'Иванов')
+        await cache.set_search('Иван', 'Иванов', stale, generation)
+        filled, _ = await cache.get_search('Иван', 'Иванов')
+        return raced, filled
+
+    raced, filled = asyncio.run(scenario())
+    assert raced is None
+    assert filled[0]['login'] == 'ivan'
+
+
+def test_invalidation_covers_every_codec():
+    async def scenario():
+        server = fakeredis.FakeServer()
+        loader, calls = make_loader(0)
+        caches = [
+            UserCache(fakeredis.FakeAsyncRedis(server=server), 300, 100, 30, codec=codec)
+            for codec in (JsonCodec(), MsgpackCodec())
+        ]
+        for cache in caches:
+            await cache.get_or_load('ivan', loader)
+            await cache.set_search('Иван', 'Иванов', [], b'')
+        CacheInvalidator(fakeredis.FakeRedis(server=server)).invalidate_users(['ivan'])
+        CacheInvalidator(fakeredis.FakeRedis(server=server)).invalidate_search([('Иван', 'Иванов')])
+        return [
+            await cache.redis.exists(cache.key('ivan'), search_key(cache.codec, 'Иван', 'Иванов'))
+            for cache in caches
+        ]
+
+    assert asyncio.run(scenario()) == [0, 0]
+
+
+def test_bloom_rebuild_keeps_logins_added_concurrently():
+    async def scenario():
+        server = fakeredis.FakeServer()
+        bloom = BloomFilter('logins_bloom', 2 ** 16, 5)
+        redis_client = fakeredis.FakeRedis(server=server)
+        bloom.add_many(redis_client, ['deleted'])
+
+        def snapshot():
+            yield 'ivan'
+            bloom.add_many(redis_client, ['petr'])
+            yield 'anna'
+
+        bloom.rebuild(redis_client, snapshot())
+        async_client = fakeredis.FakeAsyncRedis(server=server)
+        return {login: await bloom.might_contain(async_client, login) for login in ('ivan', 'anna', 'petr', 'deleted')}
+
+    assert asyncio.run(scenario()) == {'ivan': True, 'anna': True, 'petr': True, 'deleted': False}
@@ -0,0 +1,133 @@
+from coalesce import coalesce_events
+from consumer import SessionLocal, process_batch, process_message
+from events import encode_event
+from users import User, hash
+import random
+import sqlite3
+
+LOGINS = ['a', 'b', 'c', 'd']
+PASSWORDS = {f'{kind}{version}': hash(f'{kind}{version}') for kind in 'hr' for version in range(13)}
+
+
+class Message:
+    def __init__(self, action: str, data):
+        self.payload = encode_event(action, data)
+
+    def value(self):
+        return self.payload
+
+
+def model_table(initial: list):
+    connection = sqlite3.connect(':memory:')
+    connection.execute('CREATE TABLE users (login TEXT PRIMARY KEY, name TEXT, age INTEGER, password TEXT)')
+    connection.executemany('INSERT INTO users VALUES (?, ?, ?, ?)', initial)
+    return connection
+
+
+def model_apply(connection, action: str, data):
+    if action == 'create':
+        connection.execute(
+            'INSERT OR IGNORE INTO users VALUES (?, ?, ?, ?)',
+            (data['login'], data['name'], data['age'], data['password'])
+        )
+    elif action == 'bulk_create':
+        for item in data:
+            model_apply(connection, 'create', item)
+    elif action == 'delete':
+        connection.execute('DELETE FROM users WHERE login = ?', (data['login'],))
+    elif action == 'update':
+        try:
+            connection.execute(
+                'UPDATE users SET login = ?, name = ?, age = ?, password = ? WHERE login = ?',
+                (data['login'], data['name'], data['age'], data['password'], data['old_login'])
+            )
+        except sqlite3.IntegrityError:
+            pass
+    elif action == 'rehash':
+        connection.execute(
+            'UPDATE users SET password = ? WHERE login = ? AND password = ?',
+            (data['password'], data['login'], data['old_password'])
+        )
+
+
+def random_case(rng: random.Random, prefix: str = ''):
+    logins = [prefix + login for login in LOGINS]
+    initial = [(login, 'initial', 0, PASSWORDS['h0']) for login in logins if rng.random() < 0.5]
+    events = []
+    for version in range(1, rng.randint(1, 12) + 1):
+        login, roll = rng.choice(logins), rng.random()
+        row = {
+            'login': login, 'password': PASSWORDS[f'h{version}'], 'name': f'n{version}', 'surname': 's',
+            'age': version, 'email': None
+        }
+        if roll < 0.1:
+            events.append(('rehash', {
+                'login': login, 'password': PASSWORDS[f'r{version}'],
+                'old_password': PASSWORDS[f'h{rng.randrange(version)}']
+            }))
+        elif roll < 0.3:
+            events.append(('create', row))
+        elif roll < 0.4:
+            events.append(('bulk_create', [row, dict(row, login=rng.choice(logins), name=f'b{version}')]))
+        elif roll < 0.6:
+            events.append(('delete', {'login': login}))
+        else:
+            new_login = rng.choice(logins) if rng.random() < 0.5 else login
+            events.append(('update', dict(row, login=new_login, old_login=login)))
+    return logins, initial, events
+
+
+def test_coalesced_batch_matches_sequential_application():
+    rng = random.Random(25)
+    for _ in range(20000):
+        _, initial, events = random_case(rng)
+        sequential, coalesced = model_table(initial), model_table(initial)
+        for action, data in events:
+            model_apply(sequential, action, data)
+        for action, data in coalesce_events(events):
+            model_apply(coalesced, action, data)
+        expected = sorted(sequential.execute('SELECT * FROM users'))
+        assert sorted(coalesced.execute('SELECT * FROM users')) == expected, (initial, events)
+
+
+def test_coalescing_reduces_a_burst_to_one_event():
+    row = {'login': 'a', 'password': 'hash', 'name': 'n', 'surname': 's', 'age': 1, 'email': None}
+    events = [
+        ('create', row),
+        ('update', dict(row, age=2, old_login='a')),
+        ('update', dict(row, age=3, old_login='a')),
+        ('delete', {'login': 'a'}),
+    ]
+    assert coalesce_events(events) == [('delete', {'login': 'a'})]
+
+
+def consumer_table(logins: list, initial: list, apply) -> list:
+    db = SessionLocal()
+    try:
+        db.query(User).filter(User.login.in_(logins)).delete(synchronize_session=False)
+        db.add_all([
+            User(login=login, password=password, name=name, surname='s', age=age)
+            for login, name, age, password in initial
+        ])
+        db.commit()
+        apply(db)
+        rows = db.query(User.login, User.name, User.age, User.password).filter(
+            User.login.in_(logins)
+        ).order_by(User.login).all()
+        return [tuple(row) for row in rows]
+    finally:
+        db.close()
+
+
+def test_consumer_batch_matches_one_by_one_processing():
+    rng = random.Random(2025)
+    for _ in range(150):
+        logins, initial, events = random_case(rng, prefix='coalesce_')
+        messages = [Message(action, data) for action, data in events]
+
+        def one_by_one(db):
+            for message in messages:
+                process_message(db, message)
+
+        expected = consumer_table(logins, initial, one_by_one)
+        assert consumer_table(logins, initial, lambda db: process_batch(db, messages)) == expected, (initial, events)
@@ -0,0 +1,95 @@
+from confluent_kafka import TopicPartition
+from sqlalchemy import create_engine
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+from events import encode_event
+import consumer
+import logging
+import pytest
+
+UnavailableSession = sessionmaker(bind=create_engine('sqlite:////nonexistent/users.db'))
+
+
+class Message:
+    def __init__(self, offset: int, partition: int = 0):
+        self.position = offset
+        self.number = partition
+        self.payload = encode_event('delete', {'login': f'unavailable_{offset}'})
+
+    def offset(self):
+        return self.position
+
+    def partition(self):
+        return self.number
+
+    def topic(self):
+        return 'user_events'
+
+    def value(self):
+        return self.payload
+
+    def error(self):
+        return None
+
+
+@pytest.mark.filterwarnings('ignore::pytest.PytestUnhandledThreadExceptionWarning')
+def test_worker_stops_when_database_is_unavailable(monkeypatch):
+    monkeypatch.setattr(consumer, 'SessionLocal', UnavailableSession)
+    workers = consumer.PartitionWorkers(None, batch_size=10, queue_size=100)
+    workers.on_assign(None, [TopicPartition('user_events', 0)])
+    worker = workers.workers[('user_events', 0)]
+    worker.submit(Message(0))
+    worker.join()
+
+    assert worker.pending_offset() is None
+    with pytest.raises(RuntimeError):
+        workers.check_alive()
+
+
+class FakeConsumer:
+    def __init__(self, batches: list):
+        self.batches = batches
+        self.commits = 0
+        self.seeks = []
+
+    def consume(self, num_messages: int, timeout: float):
+        return self.batches.pop(0) if self.batches else []
+
+    def commit(self, asynchronous: bool = True):
+        self.commits += 1
+
+    def seek(self, partition: TopicPartition):
+        self.seeks.append((partition.partition, partition.offset))
+
+
+class RebalancingConsumer(FakeConsumer):
+    def commit(self, asynchronous: bool = True):
+        super().commit(asynchronous)
+        raise consumer.KafkaException('Идёт перебалансировка группы')
+
+
+def test_failed_offset_commit_does_not_stop_batch_mode(caplog):
+    kafka = RebalancingConsumer([[Message(0)], [Message(1)]])
+    db = consumer.SessionLocal()
+    try:
+        with caplog.at_level(logging.ERROR, logger='consumer'):
+            consumer.consume_batch(kafka, db)
+            consumer.consume_batch(kafka, db)
+    finally:
+        db.close()
+    assert kafka.batches == [] and kafka.commits == 2
+    assert caplog.text.count('Error committing offsets') == 2
+
+
+def test_unavailable_database_propagates_from_batch():
+    db = UnavailableSession()
+    with pytest.raises(OperationalError):
+        consumer.process_batch(db, [Message(0), Message(1)])
+
+
+def test_offsets_are_not_committed_while_database_is_unavailable(monkeypatch):
+    monkeypatch.setattr(consumer, 'CONSUMER_RETRY_SECONDS', 0)
+    kafka = FakeConsumer([[Message(5), Message(6), Message(3, partition=1)]])
+    consumer.consume_batch(kafka, UnavailableSession())
+    assert kafka.commits == 0
+    assert sorted(kafka.seeks) == [(0, 5), (1, 3)]
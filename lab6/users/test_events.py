@@ -0,0 +1,148 @@
+from confluent_kafka import KafkaException
+from sqlalchemy.orm import Session
+from events import decode_event, encode_event, partition_for, topic_partitions
+from relay import OutboxRelay
+from users import OutboxEvent, engine, event_key, hash
+import users
+import asyncio
+import random
+import threading
+import time
+
+PARTITIONS = 4
+
+
+class InMemoryBroker:
+    def __init__(self, partitions: int):
+        self.partitions = [[] for _ in range(partitions)]
+        self.pending = []
+        self.metadata_requests = 0
+
+    def list_topics(self, topic: str, timeout: float = None):
+        self.metadata_requests += 1
+        raise KafkaException('Брокер недоступен')
+
+    def produce(self, topic: str, value: bytes, key: str, on_delivery, partition: int = None):
+        if partition is None:
+            partition = partition_for(key, len(self.partitions))
+        self.partitions[partition].append((key, value))
+        self.pending.append(on_delivery)
+
+    def poll(self, timeout: float):
+        pass
+
+    def flush(self, timeout: float):
+        for on_delivery in self.pending:
+            on_delivery(None, None)
+        self.pending.clear()
+        return 0
+
+
+def user(login: str, version: int) -> dict:
+    return {
+        'login': login, 'password': 'hash', 'name': 'Иван', 'surname': 'Иванов',
+        'age': version, 'email': None, 'old_login': login
+    }
+
+
+def consume_in_parallel(broker: InMemoryBroker) -> dict:
+    applied, lock = {}, threading.Lock()
+
+    def consume(messages):
+        for _, value in messages:
+            action, data = decode_event(value)
+            time.sleep(random.random() / 1000)
+            with lock:
+                for item in data if action == 'bulk_create' else [data]:
+                    applied.setdefault(item['login'], []).append((action, item['age']))
+
+    workers = [threading.Thread(target=consume, args=(messages,)) for messages in broker.partitions]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return applied
+
+
+def test_topic_partitions_returns_none_without_broker():
+    assert topic_partitions(InMemoryBroker(PARTITIONS), 'user_events', timeout=0) is None
+
+
+def test_per_user_order_survives_parallel_consumption():
+    rng = random.Random(20)
+    logins = [f'order_{i}' for i in range(40)]
+    expected, events = {login: [] for login in logins}, []
+    events.append(('bulk_create', [user(login, 0) for login in logins]))
+    for login in logins:
+        expected[login].append(('bulk_create', 0))
+    for version in range(1, 300):
+        login = rng.choice(logins)
+        action = 'delete' if rng.random() < 0.1 else 'update'
+        events.append((action, user(login, version)))
+        expected[login].append((action, version))
+
+    with Session(engine) as db:
+        db.add_all([
+            OutboxEvent(key=event_key(action, data), payload=encode_event(action, data))
+            for action, data in events
+        ])
+        db.commit()
+
+    broker = InMemoryBroker(PARTITIONS)
+    relay = OutboxRelay(broker, batch_size=10000, flush_seconds=1)
+    relay.partitions = PARTITIONS
+    with Session(engine) as db:
+        assert relay.relay_batch(db) >= len(events)
+
+    for partition, messages in enumerate(broker.partitions):
+        for _, value in messages:
+            action, data = decode_event(value)
+            for item in data if action == 'bulk_create' else [data]:
+                assert partition_for(item['login'], PARTITIONS) == partition
+
+    applied = consume_in_parallel(broker)
+    for login in logins:
+        assert applied[login] == expected[login]
+
+
+def test_relay_looks_up_partitions_once_per_retry_interval():
+    with Session(engine) as db:
+        db.add_all([
+            OutboxEvent(key=f'relay_{i}', payload=encode_event('delete', {'login': f'relay_{i}'}))
+            for i in range(20)
+        ])
+        db.commit()
+
+    broker = InMemoryBroker(PARTITIONS)
+    relay = OutboxRelay(broker, batch_size=5, flush_seconds=1, metadata_retry=60)
+    with Session(engine) as db:
+        while relay.relay_batch(db):
+            pass
+    assert broker.metadata_requests == 1
+    relayed = [key for messages in broker.partitions for key, _ in messages if key.startswith('relay_')]
+    assert len(relayed) == 20
+
+
+def test_bulk_create_does_not_wait_for_broker(client, admin_headers):
+    password = hash('secret')
+    items = [user(f'bulk_nobroker_{i}', 0) | {'password': password} for i in range(50)]
+    started = time.monotonic()
+    response = client.post('/users/bulk', json=items, headers=admin_headers)
+    assert response.status_code == 200
+    assert response.json()['accepted'] == 50
+    assert time.monotonic() - started < 1
+
+
+class UnreachableProducer:
+    def produce(self, topic: str, value: bytes, key: str = None):
+        return asyncio.get_running_loop().create_future()
+
+
+def test_direct_publish_times_out_with_503(client, admin_headers, monkeypatch):
+    monkeypatch.setattr(users, 'OUTBOX_ENABLED', False)
+    monkeypatch.setattr(users, 'KAFKA_DELIVERY_TIMEOUT_MS', 200)
+    monkeypatch.setattr(users, 'producer', UnreachableProducer())
+    started = time.monotonic()
+    response = client.post('/users', json=user('direct_timeout', 0) | {'password': 'secret'}, headers=admin_headers)
+    assert response.status_code == 503
+    assert time.monotonic() - started < 1
@@ -0,0 +1,20 @@
+from sqlalchemy.orm import Session
+from users import User, engine, hash, is_hashed, verify_password
+import fill
+
+
+def test_password_migration_hashes_only_plaintext_rows(monkeypatch):
+    monkeypatch.setattr(fill, 'PASSWORD_MIGRATION_BATCH', 2)
+    hashed = hash('kept')
+    with Session(engine) as db:
+        db.add_all([User(login=f'migrate_{i}', password=f'plain{i}', name='n', surname='s', age=1) for i in range(5)])
+        db.add(User(login='migrate_hashed', password=hashed, name='n', surname='s', age=1))
+        db.commit()
+
+    fill.migrate_passwords()
+
+    with Session(engine) as db:
+        passwords = dict(db.query(User.login, User.password).filter(User.login.startswith('migrate_')))
+    assert passwords.pop('migrate_hashed') == hashed
+    assert all(is_hashed(password) for password in passwords.values())
+    assert verify_password('plain3', passwords['migrate_3'])
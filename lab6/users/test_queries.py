@@ -0,0 +1,53 @@
+from instrumentation import QueryBudgetExceeded, max_queries
+import pytest
+
+
+def user_payload(login: str) -> dict:
+    return {'login': login, 'password': 'secret', 'name': 'Пётр', 'surname': 'Петров', 'age': 40}
+
+
+def test_max_queries_raises_over_budget(client, admin_headers, add_users):
+    add_users('budget_exceeded')
+    with pytest.raises(QueryBudgetExceeded):
+        with max_queries(0):
+            client.get('/users/budget_exceeded', params={'user_login': 'budget_exceeded'}, headers=admin_headers)
+
+
+def test_get_user_loads_once_then_serves_from_cache(client, admin_headers, add_users):
+    add_users('budget_get')
+    with max_queries(1):
+        response = client.get('/users/budget_get', params={'user_login': 'budget_get'}, headers=admin_headers)
+    assert response.status_code == 200
+    with max_queries(0):
+        response = client.get('/users/budget_get', params={'user_login': 'budget_get'}, headers=admin_headers)
+    assert response.json()['login'] == 'budget_get'
+
+
+def test_create_user_query_budget(client, admin_headers):
+    with max_queries(2):
+        response = client.post('/users', json=user_payload('budget_create'), headers=admin_headers)
+    assert response.status_code == 200
+
+
+def test_update_user_query_budget(client, admin_headers, add_users):
+    add_users('budget_update')
+    with max_queries(2):
+        response = client.put(
+            '/users/budget_update', params={'user_login': 'budget_update'},
+            json=user_payload('budget_renamed'), headers=admin_headers
+        )
+    assert response.status_code == 200
+
+
+def test_delete_user_query_budget(client, admin_headers, add_users):
+    add_users('budget_delete')
+    with max_queries(2):
+        response = client.delete('/users/budget_delete', headers=admin_headers)
+    assert response.status_code == 200
+
+
+def test_list_users_query_budget(client, admin_headers, add_users):
+    add_users(*(f'budget_list_{i}' for i in range(20)))
+    with max_queries(1):
+        response = client.get('/users', params={'limit': 20}, headers=admin_headers)
+    assert response.status_code == 200
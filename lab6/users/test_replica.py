@@ -0,0 +1,54 @@
+from users import AsyncSessionLocal, ReplicaRouter
+import asyncio
+import time
+
+
+def make_router(lag) -> ReplicaRouter:
+    router = ReplicaRouter('sqlite://', max_lag=5, check_interval=0.05, check_timeout=0.05)
+
+    async def measure_lag():
+        if lag is None:
+            await asyncio.sleep(10)
+        return lag
+
+    router.measure_lag = measure_lag
+    return router
+
+
+def test_hanging_replica_check_does_not_block_reads():
+    async def scenario():
+        router = make_router(None)
+        started = time.monotonic()
+        first = await router.choose()
+        elapsed = time.monotonic() - started
+        await asyncio.sleep(0.2)
+        second = await router.choose()
+        router.monitor.cancel()
+        return first, second, elapsed, router.healthy
+
+    first, second, elapsed, healthy = asyncio.run(scenario())
+    assert elapsed < 0.05
+    assert first is AsyncSessionLocal and second is AsyncSessionLocal
+    assert not healthy
+
+
+def test_reads_go_to_fresh_healthy_replica_only():
+    async def scenario():
+        router = make_router(0.0)
+        await router.choose()
+        await asyncio.sleep(0.02)
+        healthy = await router.choose()
+        router.monitor.cancel()
+        router.checked_at -= 1
+        stale = await router.choose()
+        lagging = make_router(30.0)
+        await lagging.choose()
+        await asyncio.sleep(0.02)
+        behind = await lagging.choose()
+        lagging.monitor.cancel()
+        return router, healthy, stale, behind
+
+    router, healthy, stale, behind = asyncio.run(scenario())
+    assert healthy is router.sessionmaker
+    assert stale is AsyncSessionLocal
+    assert behind is AsyncSessionLocal
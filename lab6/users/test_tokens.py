@@ -0,0 +1,131 @@
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from passlib.hash import bcrypt
+from events import decode_event
+from fastapi import HTTPException
+from users import MemoryTokenStore, OutboxEvent, RedisTokenStore, RefreshRequest, User, engine
+import users
+import asyncio
+import fakeredis
+import pytest
+import time
+
+
+def test_login_rehash_publishes_password_only_event(client):
+    old_hash = bcrypt.using(rounds=5).hash('secret')
+    with Session(engine) as db:
+        db.add(User(login='rehash_user', password=old_hash, name='Олег', surname='Орлов', age=50))
+        db.commit()
+
+    response = client.post('/token', data={'username': 'rehash_user', 'password': 'secret'})
+    assert response.status_code == 200
+
+    with Session(engine) as db:
+        payloads = db.scalars(select(OutboxEvent.payload).where(OutboxEvent.key == 'rehash_user')).all()
+    action, data = decode_event(payloads[-1])
+    assert action == 'rehash'
+    assert data['old_password'] == old_hash
+    assert data['password'] != old_hash and data['name'] is None
+
+
+@pytest.mark.parametrize('make_store', [
+    MemoryTokenStore,
+    lambda: RedisTokenStore(fakeredis.FakeAsyncRedis(server=fakeredis.FakeServer())),
+])
+def test_refresh_token_is_used_once_under_concurrency(monkeypatch, make_store):
+    monkeypatch.setattr(users, 'token_store', make_store())
+
+    async def scenario():
+        refresh_token = await users.create_refresh_token('ivan')
+        request = RefreshRequest(refresh_token=refresh_token)
+        return await asyncio.gather(*(users.refresh_access_token(request) for _ in range(10)), return_exceptions=True)
+
+    results = asyncio.run(scenario())
+    issued = [result for result in results if isinstance(result, dict)]
+    rejected = [result for result in results if isinstance(result, HTTPException)]
+    assert len(issued) == 1 and len(rejected) == 9
+
+
+def test_token_without_expiry_is_accepted(client):
+    token = users.jwt.encode({'login': 'no_exp_user'}, users.SECRET_KEY, algorithm=users.ALGORITHM)
+    response = client.get('/users', params={'limit': 1}, headers={'Authorization': f'Bearer {token}'})
+    assert response.status_code == 200
+
+
+def test_memory_store_prunes_unread_expired_tokens():
+    async def scenario():
+        store = MemoryTokenStore(prune_interval=0)
+        for i in range(100):
+            await store.set(f'expired_{i}', 'ivan', ex=0)
+            await store.track('ivan', f'expired_{i}', ex=0)
+        await store.set('fresh', 'petr', ex=60)
+        return store
+
+    store = asyncio.run(scenario())
+    assert list(store.values) == ['fresh']
+    assert 'ivan' not in store.logins
+
+
+@pytest.mark.parametrize('make_store', [
+    MemoryTokenStore,
+    lambda: RedisTokenStore(fakeredis.FakeAsyncRedis(server=fakeredis.FakeServer())),
+])
+def test_revoking_login_drops_all_its_refresh_tokens(monkeypatch, make_store):
+    monkeypatch.setattr(users, 'token_store', make_store())
+
+    async def scenario():
+        revoked = [await users.create_refresh_token('ivan') for _ in range(3)]
+        kept = await users.create_refresh_token('petr')
+        await users.token_store.revoke_login('ivan')
+        return [await users.token_store.get(users.refresh_token_key(token)) for token in revoked + [kept]]
+
+    assert asyncio.run(scenario()) == [None, None, None, 'petr']
+
+
+def refresh(client, refresh_token: str):
+    return client.post('/token/refresh', json={'refresh_token': refresh_token})
+
+
+def test_delete_and_password_change_revoke_refresh_tokens(client, admin_headers, add_users):
+    add_users('revoke_deleted', 'revoke_changed', 'revoke_same')
+    tokens = {
+        login: client.post('/token', data={'username': login, 'password': 'secret'}).json()['refresh_token']
+        for login in ('revoke_deleted', 'revoke_changed', 'revoke_same')
+    }
+    profile = {'name': 'Иван', 'surname': 'Иванов', 'age': 30, 'email': None}
+
+    assert client.delete('/users/revoke_deleted', params={'user_login': 'revoke_deleted'},
+                         headers=admin_headers).status_code == 200
+    assert client.put('/users/revoke_changed', params={'user_login': 'revoke_changed'}, headers=admin_headers,
+                      json=profile | {'login': 'revoke_changed', 'password': 'other'}).status_code == 200
+    assert client.put('/users/revoke_same', params={'user_login': 'revoke_same'}, headers=admin_headers,
+                      json=profile | {'login': 'revoke_same', 'password': 'secret'}).status_code == 200
+
+    assert refresh(client, tokens['revoke_deleted']).status_code == 401
+    assert refresh(client, tokens['revoke_changed']).status_code == 401
+    assert refresh(client, tokens['revoke_same']).status_code == 200
+
+
+class SilentProducer:
+    def __init__(self):
+        self.sent = []
+
+    def produce(self, topic: str, value: bytes, key: str = None):
+        self.sent.append(key)
+        return asyncio.get_running_loop().create_future()
+
+
+def test_direct_mode_login_does_not_wait_for_rehash_delivery(client, monkeypatch):
+    producer = SilentProducer()
+    monkeypatch.setattr(users, 'OUTBOX_ENABLED', False)
+    monkeypatch.setattr(users, 'KAFKA_DELIVERY_TIMEOUT_MS', 3000)
+    monkeypatch.setattr(users, 'producer', producer)
+    with Session(engine) as db:
+        db.add(User(login='rehash_direct', password=bcrypt.using(rounds=5).hash('secret'), name='n', surname='s', age=1))
+        db.commit()
+
+    started = time.monotonic()
+    response = client.post('/token', data={'username': 'rehash_direct', 'password': 'secret'})
+    assert response.status_code == 200
+    assert time.monotonic() - started < 1
+    assert producer.sent == ['rehash_direct']